@@ -4,12 +4,15 @@ FastAPI app + background worker for downloading anime episode videos and
 uploading them to HuggingFace Dataset storage accounts.
 
 Architecture:
-  - FastAPI serves /health and /trigger endpoints
-  - Background asyncio task polls Supabase video_queue every 10 seconds
-  - On POST /trigger: immediately process the given queue entry (realtime)
-  - Downloads via aria2c (multi-thread, fast for large files)
+  - FastAPI serves /health, /status and /trigger endpoints
+  - Background asyncio task claims pending video_queue rows on each
+    LISTEN video_queue_new notification, with a 60s watchdog poll
+    (polls every 5 seconds when SUPABASE_DB_URL is unset or LISTEN is down)
+  - On POST /trigger: claim the given queue entry right away (batched per
+    250ms; a no-op while LISTEN is up, since the enqueue already notified)
+  - Downloads via aria2c (multi-thread, fast for large files; HLS segments in parallel)
   - Uploads via huggingface_hub with path_or_fileobj → auto Git LFS for >5MB files
-  - Distributes across 5 storage accounts (least-used first, round-robin fallback)
+  - Uploads to all 5 storage accounts in parallel (first success becomes primary)
   - Filenames obfuscated via SHA-256 hash + secret salt
 
 Environment variables (set in HF Space settings):
@@ -20,28 +23,52 @@ Environment variables (set in HF Space settings):
   HF_STORAGE_USERNAME_1..5    — HF usernames for 5 storage accounts
   HF_FILE_SALT                — Secret salt for filename obfuscation
   CLOUDFLARE_WORKERS_URL      — CF Workers base URL for constructing stream_url
+  SUPABASE_DB_URL             — (optional) Postgres URL (session mode, port 5432) for
+                                LISTEN video_queue_new; unset → poll every 5 seconds
+  WEABOO_HASH_ALGO            — (optional) file_key hash: sha256 (default) or blake2b
+  WEABOO_ARIA_CONNS           — (optional) aria2c connections/splits per download (default/max 16)
 """
 
 from __future__ import annotations
 
 import asyncio
+import copy
+import functools
 import hashlib
+import io
+import itertools
 import logging
 import os
+import random
 import re
 import shutil
-import subprocess
 import tempfile
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Hashable, Optional, Union
+from urllib.parse import quote, urljoin
 
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Security
+from fastapi import FastAPI, HTTPException, Request, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 _bearer_scheme = HTTPBearer(auto_error=False)
-from fastapi.responses import JSONResponse
-from huggingface_hub import HfApi
-from huggingface_hub.utils import RepositoryNotFoundError
+from fastapi.responses import ORJSONResponse
+import asyncpg
+import httpx
+import orjson
+import requests
+
+# Parallel multipart LFS uploads via the Rust hf_transfer backend. Read by
+# huggingface_hub at import time, so it must be set before the import below.
+# Path payloads only — in-memory (Mega) uploads fall back to the regular path.
+os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+from huggingface_hub import CommitOperationAdd, HfApi, configure_http_backend
+from huggingface_hub.utils import HfHubHTTPError, RepositoryNotFoundError
+from postgrest.exceptions import APIError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from supabase import Client, create_client
 
 # ── Logging ───────────────────────────────────────────────────────────────────
@@ -57,8 +84,20 @@ log = logging.getLogger("weaboo-worker")
 
 SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+# Optional direct Postgres URL (session mode, port 5432) for LISTEN/NOTIFY.
+# Without it the worker falls back to polling every 5s.
+SUPABASE_DB_URL = os.environ.get("SUPABASE_DB_URL", "")
 HF_FILE_SALT = os.environ.get("HF_FILE_SALT", "weaboo-default-salt")
 CF_WORKERS_BASE_URL = os.environ.get("CLOUDFLARE_WORKERS_URL", "").rstrip("/")
+# file_key hash: "sha256" (default, matches keys already in video_store) or "blake2b"
+WEABOO_HASH_ALGO = os.environ.get("WEABOO_HASH_ALGO", "sha256").strip().lower()
+# aria2c connections (and splits) per download; 16 is aria2c's own ceiling.
+# Lower it for hosts that throttle or ban many parallel connections.
+try:
+    WEABOO_ARIA_CONNS = max(1, min(16, int(os.environ.get("WEABOO_ARIA_CONNS", "16"))))
+except ValueError:
+    log.warning(f"⚠️  Invalid WEABOO_ARIA_CONNS={os.environ['WEABOO_ARIA_CONNS']!r}, using 16")
+    WEABOO_ARIA_CONNS = 16
 # Webhook secret — pakai HF_FILE_SALT yang sudah ada, tidak perlu env var baru
 WEBHOOK_SECRET = HF_FILE_SALT
 
@@ -83,14 +122,89 @@ if not _valid_accounts:
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Async PostgREST client for the per-job RPCs (claim, status, upsert) — native
+# async keep-alive, no executor hop. supabase-py stays for low-frequency calls.
+_supabase_http = httpx.AsyncClient(
+    base_url=f"{SUPABASE_URL}/rest/v1",
+    headers={
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": "application/json",
+    },
+    timeout=30,
+)
+
+# ── Thread pools ──────────────────────────────────────────────────────────────
+
+# Max jobs in flight at once (see _job_semaphore) — also sizes the upload pool
+_MAX_CONCURRENT_JOBS = 5
+
+# Long-running blocking downloads (Mega CDN read + AES decrypt, Vidhidepro
+# re-resolve) get their own small pool so they can't starve the short
+# HF/Supabase calls. aria2c/ffmpeg run as asyncio subprocesses and need no thread.
+_download_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="download")
+# HF uploads can block for minutes; Supabase calls are short. Separate bounded
+# pools keep a burst of uploads from queueing status writes behind them.
+# Every job uploads to all accounts at once, so one thread per (job, account)
+# keeps a full house of jobs from waiting on each other's uploads.
+_upload_executor = ThreadPoolExecutor(
+    max_workers=max(1, len(_valid_accounts)) * _MAX_CONCURRENT_JOBS,
+    thread_name_prefix="hf-upload",
+)
+_db_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="supabase")
+# Installed as the loop's default executor in lifespan, so asyncio.to_thread
+# (temp cleanup, payload hashing) is bounded instead of min(32, cpu + 4).
+_default_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="weaboo")
+
+# Each aria2c/ffmpeg child is pinned to the next core in turn (when the Space
+# has at least two), so concurrent downloads spread over every CPU instead of
+# migrating between them; single-core hosts don't pin at all.
+_SUBPROCESS_CPUS: list[int] = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+_subprocess_cpu_cycle = itertools.cycle(_SUBPROCESS_CPUS) if len(_SUBPROCESS_CPUS) >= 2 else None
+
 # ── HuggingFace helpers ───────────────────────────────────────────────────────
 
+# Gateway blips during the parallel upload burst; urllib3 only retries
+# idempotent methods by default, so commits (POST) are never replayed.
+_HF_RETRY = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), raise_on_status=False)
+
+
+def _hf_session_factory() -> requests.Session:
+    """
+    Session factory for huggingface_hub (one Session per thread). A pooled
+    adapter keeps connections to huggingface.co alive across calls, so repeated
+    repo_info / preupload / commit requests skip the TLS handshake.
+    Gateway errors (502/503/504) on idempotent requests — repo_info, LFS part
+    PUTs — are retried with backoff in urllib3; after the last try the
+    response is returned as-is so huggingface_hub raises its usual error.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=_HF_RETRY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+configure_http_backend(backend_factory=_hf_session_factory)
+
+
+# Per-account constants, built once at startup as parallel lists indexed by
+# account_idx (None for unconfigured slots) so the upload path just indexes.
+_hf_apis: list[Optional[HfApi]] = [
+    HfApi(token=HF_TOKENS[idx]) if idx in _valid_accounts else None for idx in range(HF_STORAGE_COUNT)
+]
+
+
 def get_hf_api(account_idx: int) -> HfApi:
-    """Return an HfApi instance for the given storage account index (0-based)."""
-    token = HF_TOKENS[account_idx]
-    if not token:
+    """Return the shared HfApi instance for the given storage account index (0-based)."""
+    api = _hf_apis[account_idx]
+    if api is None:
         raise ValueError(f"HF_TOKEN_STORAGE_{account_idx + 1} is not set")
-    return HfApi(token=token)
+    return api
+
+
+# Characters not allowed in an HF username (anything but alphanumerics, '-', '_', '.')
+_USERNAME_STRIP_RE = re.compile(r"[^a-zA-Z0-9\-_.]")
 
 
 def get_repo_id(account_idx: int) -> str:
@@ -107,7 +221,7 @@ def get_repo_id(account_idx: int) -> str:
     # Sanitize username: strip whitespace, replace spaces with hyphens
     username = username.strip().replace(" ", "-")
     # Remove any characters that are not alphanumeric, hyphen, underscore, or dot
-    username = re.sub(r"[^a-zA-Z0-9\-_.]", "", username)
+    username = _USERNAME_STRIP_RE.sub("", username)
     # Strip leading/trailing hyphens and dots
     username = username.strip("-.")
     if not username:
@@ -115,6 +229,20 @@ def get_repo_id(account_idx: int) -> str:
     return f"{username}/weaboo-storage"
 
 
+def _precompute_repo_id(account_idx: int) -> Optional[str]:
+    """get_repo_id for a configured account, or None (logged) if unusable."""
+    if account_idx not in _valid_accounts:
+        return None
+    try:
+        return get_repo_id(account_idx)
+    except ValueError as e:
+        log.warning(f"⚠️  {e}")
+        return None
+
+
+_repo_ids: list[Optional[str]] = [_precompute_repo_id(idx) for idx in range(HF_STORAGE_COUNT)]
+
+
 def ensure_repo_exists(api: HfApi, repo_id: str, private: bool = False) -> None:
     """
     Create the HF dataset repo if it doesn't exist yet.
@@ -130,43 +258,53 @@ def ensure_repo_exists(api: HfApi, repo_id: str, private: bool = False) -> None:
         api.create_repo(repo_id=repo_id, repo_type="dataset", private=private)
 
 
-def pick_storage_account(mal_id: int) -> int:
-    """
-    Pick the best storage account index (0-based) for a given anime.
-    Strategy:
-      1. Check which accounts have the fewest repos (least used)
-      2. Fallback: round-robin via mal_id % count
-    Returns account index (0-based).
-    """
-    if not _valid_accounts:
-        raise RuntimeError("No valid HF storage accounts configured")
+# (account_idx, repo_id) pairs already confirmed to exist — the repo is global per
+# account and created once, so later jobs skip the repo_info round trip.
+_known_repos: set[tuple[int, str]] = set()
 
-    # Try to find least-used account by checking repo count
-    min_count = float("inf")
-    best_idx = _valid_accounts[mal_id % len(_valid_accounts)]  # fallback
 
-    for idx in _valid_accounts:
-        try:
-            api = get_hf_api(idx)
-            repos = list(api.list_datasets(author=HF_USERNAMES[idx], limit=100))
-            count = len(repos)
-            if count < min_count:
-                min_count = count
-                best_idx = idx
-        except Exception as e:
-            log.debug(f"  Could not check account {idx + 1} repo count: {e}")
+def _confirm_repo(account_idx: int) -> None:
+    """ensure_repo_exists for one account's storage repo and mark it known. Logs failures."""
+    repo_id = _repo_ids[account_idx]
+    try:
+        ensure_repo_exists(get_hf_api(account_idx), repo_id)
+    except Exception as e:
+        log.warning(f"⚠️  Could not confirm repo for account {account_idx + 1}: {e}")
+        return
+    _known_repos.add((account_idx, repo_id))
+
+
+async def _prewarm_repo_cache() -> None:
+    """Confirm every account's storage repo once at startup so the first jobs skip repo_info."""
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(
+        loop.run_in_executor(_upload_executor, _confirm_repo, idx)
+        for idx in _valid_accounts if _repo_ids[idx]
+    ))
+    log.info(f"🔥 Repo cache prewarmed: {len(_known_repos)}/{len(_valid_accounts)} storage repo(s) known")
+
 
-    return best_idx
+_SALT_BYTES = HF_FILE_SALT.encode()
+
+# Salt-primed hasher; make_file_key copies it instead of re-hashing the salt.
+# blake2b with a 16-byte digest gives the same 32 hex chars without a slice.
+if WEABOO_HASH_ALGO == "blake2b":
+    _file_key_hasher = hashlib.blake2b(_SALT_BYTES, digest_size=16)
+else:
+    if WEABOO_HASH_ALGO != "sha256":
+        log.warning(f"⚠️  Unknown WEABOO_HASH_ALGO={WEABOO_HASH_ALGO!r}, using sha256")
+    _file_key_hasher = hashlib.sha256(_SALT_BYTES)
 
 
 def make_file_key(mal_id: int, episode: int, provider: str, resolution: Optional[str]) -> str:
     """
-    Generate an obfuscated filename key using SHA-256.
+    Generate an obfuscated filename key using SHA-256 (or BLAKE2b, see WEABOO_HASH_ALGO).
     Format: first 32 hex chars of SHA-256(salt:mal_id:episode:provider:resolution)
     The extension (.mp4 or .m3u8) is appended separately at upload time.
     """
-    raw = f"{HF_FILE_SALT}:{mal_id}:{episode}:{provider}:{resolution or 'unknown'}"
-    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+    h = _file_key_hasher.copy()
+    h.update(f":{mal_id}:{episode}:{provider}:{resolution or 'unknown'}".encode())
+    return h.hexdigest()[:32]
 
 
 def make_hf_path(mal_id: int, episode: int, file_key: str, is_hls: bool) -> str:
@@ -186,20 +324,60 @@ def make_stream_url(hf_direct_url: str) -> str:
     """
     if not CF_WORKERS_BASE_URL:
         return hf_direct_url  # fallback: return HF URL directly if CF not configured
-    encoded = hf_direct_url.replace(":", "%3A").replace("/", "%2F").replace("?", "%3F").replace("=", "%3D").replace("&", "%26")
-    return f"{CF_WORKERS_BASE_URL}/proxy?url={encoded}"
+    return f"{CF_WORKERS_BASE_URL}/proxy?url={quote(hf_direct_url, safe='')}"
 
 
 # ── aria2c / mega / ffmpeg download ──────────────────────────────────────────
 
+# Shared keep-alive session for the Mega API/CDN and Vidhidepro fetches, so
+# retries and back-to-back jobs on the same host skip the TLS handshake.
+# Retries stay in our own loops (max_retries=0).
+_http = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0)
+_http.mount("http://", _http_adapter)
+_http.mount("https://", _http_adapter)
+
+# URL prefixes of the hosts the Weaboo API hands us — a tuple startswith() is
+# far cheaper than urlparse() and covers every URL the resolver produces.
+_MEGA_HOSTS = (
+    "https://mega.nz/",
+    "https://mega.co.nz/",
+    "https://www.mega.nz/",
+    "http://mega.nz/",
+)
+_VIDHIDEPRO_HOSTS = tuple(
+    f"{scheme}://{www}{host}."
+    for scheme in ("https", "http")
+    for www in ("", "www.")
+    for host in ("vidhidepro", "vidhidefast", "callistanise")
+)
+
+# Mega NODE_ID + KEY from /embed/ or /file/ URLs
+_MEGA_NODE_RE = re.compile(r"mega\.nz/(?:embed|file)/([A-Za-z0-9_-]+)#?([A-Za-z0-9_-]*)")
+# Dean Edwards packer: eval(function(p,a,c,k,e,d){...}('...',N,N,'...'.split('|')))
+_PACKED_JS_RE = re.compile(
+    r"eval\(function\(p,a,c,k,e,(?:d|r)\)\{.*?\}\('(.*?)',(\d+),(\d+),'(.*?)'\.split\('\|'\)\)",
+    re.DOTALL,
+)
+# Word tokens in the packed payload that the unpacker swaps for dictionary words
+_PACKED_WORD_RE = re.compile(r"\b\w+\b")
+# HLS links in unpacked Vidhidepro JS, in order of preference (hls2 = highest quality)
+_HLS_KEY_RES = [(key, re.compile(rf'"{key}"\s*:\s*"([^"]+)"')) for key in ("hls2", "hls4", "hls3")]
+
+# First variant in a master playlist: the URI line right after #EXT-X-STREAM-INF
+_M3U8_VARIANT_RE = re.compile(r"^#EXT-X-STREAM-INF[^\r\n]*\r?\n[ \t]*([^\s#][^\r\n]*)", re.MULTILINE)
+# Playlist tags a plain segment concat can't reproduce (variants, fMP4 init
+# segments, byte ranges) — such playlists go to ffmpeg's HLS demuxer instead
+_HLS_FFMPEG_ONLY_TAGS = ("#EXT-X-STREAM-INF", "#EXT-X-MAP", "#EXT-X-BYTERANGE")
+
+# Browser UA + Referer for HLS CDNs (dramiyos-cdn, acek-cdn) so they don't 403
+_HLS_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+_HLS_REFERER = "https://callistanise.com/"
+
+
 def _is_mega_url(url: str) -> bool:
     """Detect if a URL is a Mega.nz embed or file URL."""
-    try:
-        from urllib.parse import urlparse
-        hostname = urlparse(url).hostname or ""
-        return "mega.nz" in hostname or "mega.co.nz" in hostname
-    except Exception:
-        return False
+    return url.startswith(_MEGA_HOSTS)
 
 
 def _mega_base64_to_bytes(s: str) -> bytes:
@@ -224,10 +402,17 @@ def _mega_get_file_key_and_iv(key_bytes: bytes):
     return aes_key, iv
 
 
-def _download_mega(url: str, output_path: str) -> bool:
+# Mega files up to this size are decrypted straight into memory and uploaded
+# from there — no tmp file write + re-read. Larger files still go to disk.
+_MEGA_IN_MEMORY_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _download_mega(url: str, output_path: str) -> Optional[Union[str, bytearray]]:
     """
     Download and decrypt a Mega.nz file without mega.py library.
     Compatible with Python 3.11+ (mega.py uses removed asyncio.coroutine).
+    Returns the upload payload: the decrypted bytearray for files up to
+    _MEGA_IN_MEMORY_MAX_BYTES, otherwise output_path. None on failure.
 
     Mega file encryption: AES-128-CTR with key+IV embedded in URL hash fragment.
     URL format: https://mega.nz/embed/{NODE_ID}#{KEY_BASE64}
@@ -237,10 +422,8 @@ def _download_mega(url: str, output_path: str) -> bool:
       1. Parse NODE_ID and KEY from URL
       2. POST to Mega API (/cs) with action "g" → get CDN URL + encrypted attr
       3. Download encrypted bytes from CDN URL via aria2c (fast multi-thread)
-      4. Decrypt AES-128-CTR on-the-fly while writing output file
+      4. Decrypt AES-128-CTR on-the-fly into memory (or the output file if large)
     """
-    import urllib.request
-    import json as json_mod
     from Crypto.Cipher import AES
 
     log.info(f"  ⬇️  Mega native download (AES-128-CTR decrypt): {url[:80]}...")
@@ -248,23 +431,23 @@ def _download_mega(url: str, output_path: str) -> bool:
     try:
         # ── Step 1: Parse NODE_ID and KEY from URL ────────────────────────────
         # Handle both /embed/ and /file/ paths
-        node_match = re.search(r"mega\.nz/(?:embed|file)/([A-Za-z0-9_-]+)#?([A-Za-z0-9_-]*)", url)
+        node_match = _MEGA_NODE_RE.search(url)
         if not node_match:
             log.error(f"  ❌ Mega: cannot parse NODE_ID from URL: {url}")
-            return False
+            return None
 
         node_id = node_match.group(1)
         key_b64 = node_match.group(2)
 
         if not key_b64:
             log.error("  ❌ Mega: no KEY in URL hash — cannot decrypt")
-            return False
+            return None
 
         # Decode the file key (32 bytes for a file)
         raw_key = _mega_base64_to_bytes(key_b64)
         if len(raw_key) != 32:
             log.error(f"  ❌ Mega: unexpected key length {len(raw_key)} (expected 32)")
-            return False
+            return None
 
         aes_key, iv = _mega_get_file_key_and_iv(raw_key)
 
@@ -275,24 +458,22 @@ def _download_mega(url: str, output_path: str) -> bool:
         max_retries = 5
         for attempt in range(max_retries):
             api_url = f"https://g.api.mega.co.nz/cs?id={os.urandom(4).hex()}"
-            req_body = json_mod.dumps([{"a": "g", "g": 1, "p": node_id}]).encode()
-            req = urllib.request.Request(
+            resp = _http.post(
                 api_url,
-                data=req_body,
+                json=[{"a": "g", "g": 1, "p": node_id}],
                 headers={
-                    "Content-Type": "application/json",
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
                     "Origin": "https://mega.nz",
                     "Referer": "https://mega.nz/",
                 },
-                method="POST",
+                timeout=30,
             )
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                api_data = json_mod.loads(resp.read())
+            resp.raise_for_status()
+            api_data = resp.json()
 
             if not isinstance(api_data, list) or not api_data:
                 log.error(f"  ❌ Mega API: unexpected response: {api_data}")
-                return False
+                return None
 
             result = api_data[0]
 
@@ -305,110 +486,193 @@ def _download_mega(url: str, output_path: str) -> bool:
 
             if isinstance(result, int):
                 log.error(f"  ❌ Mega API error code: {result}")
-                return False
+                return None
 
             cdn_url = result.get("g")
             file_size = result.get("s", 0)
             if not cdn_url:
                 log.error("  ❌ Mega API: no CDN URL in response")
-                return False
+                return None
             break  # success
 
         if cdn_url is None:
             log.error(f"  ❌ Mega API: still rate limited after {max_retries} retries")
-            return False
+            return None
 
         log.info(f"  📡 Mega CDN URL obtained, size={file_size / (1024*1024):.1f} MB")
 
-        # ── Step 3: Download encrypted bytes from CDN via urllib (streaming) ──
+        # ── Step 3: Download encrypted bytes from CDN (streaming) ──
         # We stream + decrypt simultaneously to avoid double memory usage.
         # aria2c cannot be used here because we need to decrypt on-the-fly.
-        chunk_size = 1024 * 1024  # 1 MB chunks
+        # 8 MB chunks: AES-CTR runs in C (AES-NI), so larger buffers amortize the
+        # per-iteration Python overhead and cut the number of write() syscalls.
+        chunk_size = 8 * 1024 * 1024
 
-        cdn_req = urllib.request.Request(
-            cdn_url,
-            headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"},
-        )
+        cdn_headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
         log.info(f"  ⬇️  Downloading encrypted bytes from Mega CDN...")
-        with urllib.request.urlopen(cdn_req, timeout=3600) as cdn_resp, \
-             open(output_path, "wb") as out_f:
-            # AES-128-CTR: Mega uses a custom CTR where the counter increments
-            # every 16 bytes but is tracked as 64-bit counter in the IV structure.
-            # nonce = first 8 bytes of iv, initial_value (counter) starts at 0.
-            cipher = AES.new(
-                aes_key,
-                AES.MODE_CTR,
-                nonce=iv[:8],
-                initial_value=b"\x00" * 8,
-            )
+        # AES-128-CTR: Mega uses a custom CTR where the counter increments
+        # every 16 bytes but is tracked as 64-bit counter in the IV structure.
+        # nonce = first 8 bytes of iv, initial_value (counter) starts at 0.
+        cipher = AES.new(
+            aes_key,
+            AES.MODE_CTR,
+            nonce=iv[:8],
+            initial_value=b"\x00" * 8,
+        )
+
+        if 0 < file_size <= _MEGA_IN_MEMORY_MAX_BYTES:
+            # Read straight into one preallocated buffer and decrypt in place.
+            buf = bytearray(file_size)
+            view = memoryview(buf)
             downloaded = 0
+            with _http.get(cdn_url, headers=cdn_headers, stream=True, timeout=3600) as cdn_resp:
+                cdn_resp.raise_for_status()
+                while downloaded < file_size:
+                    n = cdn_resp.raw.readinto(view[downloaded:downloaded + chunk_size])
+                    if not n:
+                        break
+                    chunk = view[downloaded:downloaded + n]
+                    cipher.decrypt(chunk, output=chunk)
+                    downloaded += n
+            if downloaded != file_size:
+                log.error(f"  ❌ Mega: truncated download ({downloaded}/{file_size} bytes)")
+                return None
+            log.info(f"  ✅ Mega download+decrypt complete: {file_size / (1024 * 1024):.1f} MB (in memory)")
+            return buf  # no bytes() copy — that would double peak memory
+
+        with _http.get(cdn_url, headers=cdn_headers, stream=True, timeout=3600) as cdn_resp, \
+             open(output_path, "wb", buffering=chunk_size) as out_f:
+            cdn_resp.raise_for_status()
+            # One buffer reused for every chunk — readinto() avoids a fresh
+            # bytes object per read.
+            buf = bytearray(chunk_size)
+            view = memoryview(buf)
             while True:
-                chunk = cdn_resp.read(chunk_size)
-                if not chunk:
+                n = cdn_resp.raw.readinto(buf)
+                if not n:
                     break
-                decrypted = cipher.decrypt(chunk)
-                out_f.write(decrypted)
-                downloaded += len(chunk)
+                out_f.write(cipher.decrypt(view[:n]))
 
         if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
             log.error("  ❌ Mega: output file missing or empty after decrypt")
-            return False
+            return None
 
         size_mb = os.path.getsize(output_path) / (1024 * 1024)
         log.info(f"  ✅ Mega download+decrypt complete: {size_mb:.1f} MB → {output_path}")
-        return True
+        return output_path
 
     except Exception as e:
         log.error(f"  ❌ Mega native download failed: {e}")
         # Clean up partial output file if it exists
         if os.path.exists(output_path):
             os.remove(output_path)
-        return False
+        return None
 
 
-def download_with_aria2c(url: str, output_path: str) -> bool:
+async def download_with_aria2c(url: str, output_path: str, is_hls: bool) -> Optional[Union[str, bytearray]]:
     """
     Download a video file. Dispatch to the correct downloader based on URL:
     - Mega.nz URLs → _download_mega (native AES-128-CTR decryption)
-    - Vidhidepro embed URLs → re-resolve fresh from HF Space ASN → ffmpeg HLS
-    - HLS .m3u8 URLs → ffmpeg (reassembles + muxes segments into MP4)
+    - Vidhidepro embed URLs → re-resolve fresh from HF Space ASN → HLS
+    - HLS .m3u8 URLs (is_hls) → aria2c segment fetch + ffmpeg concat into MP4,
+      or ffmpeg's own HLS demuxer when the playlist needs it
     - Everything else → aria2c (multi-thread accelerated direct download)
-    Returns True on success, False on failure.
+    aria2c/ffmpeg run as asyncio subprocesses; the blocking Python paths
+    (Mega decrypt, Vidhidepro re-resolve) go to the download thread pool.
+    Returns the upload payload — output_path, or the video bytes when Mega
+    kept the file in memory — or None on failure.
     """
+    loop = asyncio.get_running_loop()
+
     if _is_mega_url(url):
-        return _download_mega(url, output_path)
+        return await loop.run_in_executor(_download_executor, _download_mega, url, output_path)
 
     # Vidhidepro embed URL: re-resolve fresh so CDN token is bound to HF Space ASN
     if _is_vidhidepro_embed(url):
-        fresh_url = _resolve_vidhidepro_fresh(url)
+        fresh_url = await loop.run_in_executor(_download_executor, _resolve_vidhidepro_fresh, url)
         if fresh_url is None:
             log.error("  ❌ Vidhidepro re-resolve returned None — cannot download")
-            return False
-        return _download_hls_ffmpeg(fresh_url, output_path)
+            return None
+        ok = await _download_hls(fresh_url, output_path)
+    elif is_hls:
+        ok = await _download_hls(url, output_path)
+    else:
+        ok = await _download_mp4_aria2c(url, output_path)
+
+    return output_path if ok and os.path.exists(output_path) else None
 
-    is_hls = ".m3u8" in url or "m3u8" in url.lower()
-    if is_hls:
-        return _download_hls_ffmpeg(url, output_path)
 
-    return _download_mp4_aria2c(url, output_path)
+# Bytes of child output kept for error logs — only the tail is ever logged
+_SUBPROCESS_LOG_TAIL = 2048
 
 
-def _download_mp4_aria2c(url: str, output_path: str) -> bool:
-    """Download a direct MP4/video URL with aria2c (8 connections, 8 splits)."""
+async def _drain_tail(stream: asyncio.StreamReader, limit: int) -> bytes:
+    """Read a pipe to EOF keeping only the last limit bytes, so a chatty child can't grow memory."""
+    tail = bytearray()
+    while chunk := await stream.read(64 * 1024):
+        tail += chunk
+        if len(tail) > limit:
+            del tail[:-limit]
+    return bytes(tail)
+
+
+async def _run_subprocess(cmd: list[str], timeout: float, merge_stdout: bool = False) -> tuple[int, str]:
+    """
+    Run a command as an asyncio subprocess and wait for it without holding a
+    thread. Returns (returncode, stderr) — the last _SUBPROCESS_LOG_TAIL
+    bytes of it, drained as it's written. stdout is discarded unless
+    merge_stdout is set (aria2c prints its errors on stdout). The child is
+    pinned to the next core of _subprocess_cpu_cycle. Kills the process and
+    re-raises asyncio.TimeoutError if it runs longer than timeout.
+    """
+    if merge_stdout:
+        stdout, stderr = asyncio.subprocess.PIPE, asyncio.subprocess.STDOUT
+    else:
+        stdout, stderr = asyncio.subprocess.DEVNULL, asyncio.subprocess.PIPE
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=stdout, stderr=stderr)
+    if _subprocess_cpu_cycle is not None:
+        # Set from the parent rather than preexec_fn, which isn't safe with threads
+        try:
+            os.sched_setaffinity(proc.pid, {next(_subprocess_cpu_cycle)})
+        except OSError:
+            pass
+    pipe = proc.stdout if merge_stdout else proc.stderr
+    try:
+        tail, _ = await asyncio.wait_for(
+            asyncio.gather(_drain_tail(pipe, _SUBPROCESS_LOG_TAIL), proc.wait()), timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode, tail.decode("utf-8", errors="replace")
+
+
+async def _download_mp4_aria2c(url: str, output_path: str) -> bool:
+    """Download a direct MP4/video URL with aria2c (WEABOO_ARIA_CONNS connections/splits)."""
     output_dir = os.path.dirname(output_path)
     output_file = os.path.basename(output_path)
 
     cmd = [
         "aria2c",
-        "--split=8",                         # split file into 8 parts
-        "--max-connection-per-server=8",     # 8 connections per server
+        f"--split={WEABOO_ARIA_CONNS}",                      # split file into N parts
+        f"--max-connection-per-server={WEABOO_ARIA_CONNS}",  # N connections per server
         "--min-split-size=1M",               # min part size 1MB
+        "--piece-length=1M",                 # piece granularity for split ranges
+        "--file-allocation=none",            # no preallocation pass on the ephemeral disk
+        "--disk-cache=64M",                  # buffer writes in memory before hitting disk
+        "--async-dns=true",
         "--max-tries=3",                     # retry 3 times on error
         "--retry-wait=2",                    # wait 2s between retries
         "--timeout=60",                      # connection timeout 60s
         "--connect-timeout=30",              # DNS + connect timeout
         "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
         "--allow-overwrite=true",
+        # Only print errors — no per-second progress or result table to buffer
+        "--console-log-level=error",
+        "--summary-interval=0",
+        "--show-console-readout=false",
+        "--download-result=hide",
         f"--dir={output_dir}",
         f"--out={output_file}",
         url,
@@ -416,14 +680,14 @@ def _download_mp4_aria2c(url: str, output_path: str) -> bool:
 
     log.info(f"  ⬇️  aria2c download: {url[:80]}...")
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=3600)
-        if result.returncode == 0:
+        returncode, stderr = await _run_subprocess(cmd, timeout=3600, merge_stdout=True)
+        if returncode == 0:
             log.info(f"  ✅ Download complete: {output_path}")
             return True
         else:
-            log.error(f"  ❌ aria2c failed (code {result.returncode}): {result.stderr[:500]}")
+            log.error(f"  ❌ aria2c failed (code {returncode}): {stderr[:500]}")
             return False
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         log.error("  ❌ aria2c timed out after 1 hour")
         return False
     except FileNotFoundError:
@@ -433,12 +697,28 @@ def _download_mp4_aria2c(url: str, output_path: str) -> bool:
 
 def _is_vidhidepro_embed(url: str) -> bool:
     """Check if URL is a Vidhidepro embed URL (vidhidepro/vidhidefast/callistanise)."""
-    try:
-        from urllib.parse import urlparse
-        hostname = urlparse(url).hostname or ""
-        return any(h in hostname for h in ["vidhidepro", "vidhidefast", "callistanise"])
-    except Exception:
-        return False
+    return url.startswith(_VIDHIDEPRO_HOSTS)
+
+
+def _base_n(num: int, base: int) -> str:
+    """Encode num in the packer's base (up to 36) — the token form of a dictionary index."""
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    if num == 0:
+        return "0"
+    result = ""
+    while num:
+        result = digits[num % base] + result
+        num //= base
+    return result
+
+
+def _unpack_packed_js(p: str, a: int, c: int, k: list[str]) -> str:
+    """
+    Unpack a Dean Edwards packed payload. Single pass over p (like the packer's
+    own JS decoder) instead of one full-string re.sub per token.
+    """
+    table = {_base_n(i, a): k[i] for i in range(min(c, len(k))) if k[i]}
+    return _PACKED_WORD_RE.sub(lambda m: table.get(m.group(0), m.group(0)), p)
 
 
 def _resolve_vidhidepro_fresh(embed_url: str) -> Optional[str]:
@@ -448,12 +728,9 @@ def _resolve_vidhidepro_fresh(embed_url: str) -> Optional[str]:
     HF Space's ASN (not the API server's ASN from earlier scrape time).
     Returns fresh HLS URL or None if resolution fails.
     """
-    import urllib.request
-    import re as _re
-
     log.info(f"  🔄 Re-resolving Vidhidepro embed URL from HF Space: {embed_url[:60]}...")
     try:
-        req = urllib.request.Request(
+        resp = _http.get(
             embed_url,
             headers={
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
@@ -461,76 +738,56 @@ def _resolve_vidhidepro_fresh(embed_url: str) -> Optional[str]:
                 "Accept-Language": "id-ID,id;q=0.9,en-US;q=0.8",
                 "Referer": "https://vidhidefast.com/",
             },
+            timeout=45,
         )
-        with urllib.request.urlopen(req, timeout=45) as resp:
-            html = resp.read().decode("utf-8", errors="ignore")
+        resp.raise_for_status()
+        html = resp.content.decode("utf-8", errors="ignore")
 
         if not html or "eval(function" not in html:
             log.warning("  ⚠️  Vidhidepro re-resolve: no packed JS found")
             return None
 
         # Find and unpack the Dean Edwards packed JS
-        # Extract the packed string: eval(function(p,a,c,k,e,d){...}('...',N,N,'...'.split('|')))
-        pack_match = _re.search(
-            r"eval\(function\(p,a,c,k,e,(?:d|r)\)\{.*?\}\('(.*?)',(\d+),(\d+),'(.*?)'\.split\('\|'\)\)",
-            html,
-            _re.DOTALL,
-        )
+        pack_match = _PACKED_JS_RE.search(html)
         if not pack_match:
             log.warning("  ⚠️  Vidhidepro re-resolve: packed JS regex no match")
             return None
 
         p, a, c, k = pack_match.group(1), int(pack_match.group(2)), int(pack_match.group(3)), pack_match.group(4).split("|")
 
-        def unpack(p: str, a: int, c: int, k: list) -> str:
-            def base_n(num: int, base: int) -> str:
-                digits = "0123456789abcdefghijklmnopqrstuvwxyz"
-                if num == 0:
-                    return "0"
-                result = ""
-                while num:
-                    result = digits[num % base] + result
-                    num //= base
-                return result
-
-            for i in range(c - 1, -1, -1):
-                if k[i]:
-                    p = _re.sub(r"\b" + base_n(i, a) + r"\b", k[i], p)
-            return p
-
-        unpacked = unpack(p, a, c, k)
+        # Inline on this download thread — a single regex pass is tens of ms
+        # even for large payloads, far less than a worker process's startup
+        unpacked = _unpack_packed_js(p, a, c, k)
 
         # Extract hls2 (highest quality CDN URL)
-        for key in ["hls2", "hls4", "hls3"]:
-            m = _re.search(rf'"{key}"\s*:\s*"([^"]+)"', unpacked)
+        for key, key_re in _HLS_KEY_RES:
+            m = key_re.search(unpacked)
             if m:
                 master_url = m.group(1).replace("\\/", "/")
                 log.info(f"  🎯 Got {key} master URL: {master_url[:80]}...")
 
                 # Fetch master.m3u8 to get sub-playlist URL
-                master_req = urllib.request.Request(
+                master_resp = _http.get(
                     master_url,
                     headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"},
+                    timeout=15,
                 )
-                with urllib.request.urlopen(master_req, timeout=15) as master_resp:
-                    m3u8_content = master_resp.read().decode("utf-8", errors="ignore")
-                    final_url = master_resp.geturl()  # resolved URL after redirect
-
-                # Parse sub-playlist from master.m3u8
-                lines = m3u8_content.splitlines()
-                for i, line in enumerate(lines):
-                    if line.startswith("#EXT-X-STREAM-INF") and i + 1 < len(lines):
-                        sub_path = lines[i + 1].strip()
-                        if sub_path and not sub_path.startswith("#"):
-                            if sub_path.startswith("http"):
-                                log.info(f"  ✅ Fresh HLS URL: {sub_path[:80]}...")
-                                return sub_path
-                            else:
-                                # Relative path — absolutise using master URL base
-                                base = final_url.rsplit("/", 1)[0]
-                                abs_url = f"{base}/{sub_path}"
-                                log.info(f"  ✅ Fresh HLS URL (abs): {abs_url[:80]}...")
-                                return abs_url
+                master_resp.raise_for_status()
+                m3u8_content = master_resp.content.decode("utf-8", errors="ignore")
+                final_url = master_resp.url  # resolved URL after redirect
+
+                # Parse sub-playlist from master.m3u8 (first variant URI line)
+                variant = _M3U8_VARIANT_RE.search(m3u8_content)
+                if variant:
+                    sub_path = variant.group(1).strip()
+                    if sub_path.startswith("http"):
+                        log.info(f"  ✅ Fresh HLS URL: {sub_path[:80]}...")
+                        return sub_path
+                    # Relative path — absolutise using master URL base
+                    base = final_url.rsplit("/", 1)[0]
+                    abs_url = f"{base}/{sub_path}"
+                    log.info(f"  ✅ Fresh HLS URL (abs): {abs_url[:80]}...")
+                    return abs_url
 
                 log.warning(f"  ⚠️  Vidhidepro re-resolve: no sub-playlist in master.m3u8")
                 return master_url  # fallback: return master URL
@@ -543,14 +800,130 @@ def _resolve_vidhidepro_fresh(embed_url: str) -> Optional[str]:
         return None
 
 
-def _download_hls_ffmpeg(url: str, output_path: str) -> bool:
+async def _download_hls(url: str, output_path: str) -> bool:
+    """Download an HLS stream: parallel aria2c segment fetch, else ffmpeg's HLS demuxer."""
+    if await _download_hls_aria2c(url, output_path):
+        return True
+    return await _download_hls_ffmpeg(url, output_path)
+
+
+def _fetch_hls_segment_urls(url: str) -> Optional[list[str]]:
+    """
+    Fetch an HLS media playlist and return its absolute segment URLs.
+    Returns None if it can't be fetched or needs ffmpeg's HLS demuxer
+    (master playlist, AES key, fMP4 init segment, byte ranges).
+    """
+    try:
+        resp = _http.get(url, headers={"User-Agent": _HLS_USER_AGENT, "Referer": _HLS_REFERER}, timeout=15)
+        resp.raise_for_status()
+    except Exception as e:
+        log.warning(f"  ⚠️  HLS playlist fetch failed ({e}) — falling back to ffmpeg")
+        return None
+
+    base = resp.url  # resolved URL after redirect
+    segments: list[str] = []
+    for line in resp.content.decode("utf-8", errors="ignore").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            if line.startswith(_HLS_FFMPEG_ONLY_TAGS) or (
+                line.startswith("#EXT-X-KEY") and "METHOD=NONE" not in line
+            ):
+                return None
+            continue
+        segments.append(urljoin(base, line))
+    return segments or None
+
+
+async def _download_hls_aria2c(url: str, output_path: str) -> bool:
+    """
+    Download an HLS media playlist by fetching its segments in parallel with
+    aria2c -i, then joining them into MP4 with ffmpeg's concat demuxer (copy
+    codec). Returns False if the playlist isn't eligible or any step fails,
+    so the caller can fall back to _download_hls_ffmpeg.
+    """
+    # Short playlist GET — default pool, not _download_executor, so it never
+    # queues behind minutes-long Mega downloads
+    segments = await asyncio.to_thread(_fetch_hls_segment_urls, url)
+    if not segments:
+        return False
+
+    seg_dir = tempfile.mkdtemp(prefix="hls_", dir=os.path.dirname(output_path))
+    try:
+        names = [f"seg_{i:05d}.ts" for i in range(len(segments))]
+        input_file = os.path.join(seg_dir, "segments.txt")
+        concat_file = os.path.join(seg_dir, "concat.txt")
+        with open(input_file, "w") as f:
+            f.writelines(f"{seg}\n  out={name}\n" for seg, name in zip(segments, names))
+        with open(concat_file, "w") as f:
+            f.writelines(f"file '{name}'\n" for name in names)
+
+        aria_cmd = [
+            "aria2c",
+            f"--input-file={input_file}",
+            f"--dir={seg_dir}",
+            f"--max-concurrent-downloads={WEABOO_ARIA_CONNS}",  # N segments at once
+            "--split=1",                         # segments are small — one connection each
+            "--max-tries=5",
+            "--retry-wait=1",
+            "--timeout=60",
+            "--connect-timeout=30",
+            f"--user-agent={_HLS_USER_AGENT}",
+            f"--header=Referer: {_HLS_REFERER}",
+            "--allow-overwrite=true",
+            "--auto-file-renaming=false",
+            "--file-allocation=none",
+            "--console-log-level=error",
+            "--summary-interval=0",
+            "--show-console-readout=false",
+            "--download-result=hide",
+        ]
+        concat_cmd = [
+            "ffmpeg",
+            "-y",
+            "-loglevel", "error",
+            "-nostats",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", concat_file,
+            "-c", "copy",
+            "-bsf:a", "aac_adtstoasc",
+            output_path,
+        ]
+
+        log.info(f"  ⬇️  aria2c HLS download: {len(segments)} segments from {url[:80]}...")
+        returncode, stderr = await _run_subprocess(aria_cmd, timeout=3600, merge_stdout=True)
+        if returncode != 0:
+            log.warning(f"  ⚠️  aria2c HLS failed (code {returncode}), falling back to ffmpeg: {stderr[:500]}")
+            return False
+        returncode, stderr = await _run_subprocess(concat_cmd, timeout=600)
+        if returncode != 0:
+            log.warning(f"  ⚠️  ffmpeg concat failed (code {returncode}), falling back to ffmpeg HLS: {stderr[-500:]}")
+            return False
+        log.info(f"  ✅ HLS download complete: {output_path}")
+        return True
+    except asyncio.TimeoutError:
+        log.warning("  ⚠️  aria2c HLS download timed out, falling back to ffmpeg")
+        return False
+    except FileNotFoundError:
+        log.warning("  ⚠️  aria2c/ffmpeg not found, falling back to ffmpeg HLS")
+        return False
+    finally:
+        # Segments are no longer needed once joined — free the space before upload
+        await asyncio.to_thread(_fast_rmtree, seg_dir)
+
+
+async def _download_hls_ffmpeg(url: str, output_path: str) -> bool:
     """Download an HLS stream using ffmpeg (copy codec, no re-encode)."""
     cmd = [
         "ffmpeg",
         "-y",                    # overwrite output
+        "-loglevel", "error",    # only errors on stderr, no per-segment chatter
+        "-nostats",
         # Spoof browser UA + Referer so CDNs (dramiyos-cdn, acek-cdn) don't 403
-        "-user_agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-        "-headers", "Referer: https://callistanise.com/\r\n",
+        "-user_agent", _HLS_USER_AGENT,
+        "-headers", f"Referer: {_HLS_REFERER}\r\n",
         # Allow all HLS-related protocols
         "-allowed_extensions", "ALL",
         "-protocol_whitelist", "file,http,https,tcp,tls,crypto",
@@ -567,14 +940,14 @@ def _download_hls_ffmpeg(url: str, output_path: str) -> bool:
 
     log.info(f"  ⬇️  ffmpeg HLS download: {url[:80]}...")
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=7200)
-        if result.returncode == 0:
+        returncode, stderr = await _run_subprocess(cmd, timeout=7200)
+        if returncode == 0:
             log.info(f"  ✅ HLS download complete: {output_path}")
             return True
         else:
-            log.error(f"  ❌ ffmpeg failed (code {result.returncode}): {result.stderr[-500:]}")
+            log.error(f"  ❌ ffmpeg failed (code {returncode}): {stderr[-500:]}")
             return False
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         log.error("  ❌ ffmpeg timed out after 2 hours")
         return False
     except FileNotFoundError:
@@ -584,28 +957,166 @@ def _download_hls_ffmpeg(url: str, output_path: str) -> bool:
 
 # ── Supabase queue helpers ────────────────────────────────────────────────────
 
-def claim_pending_jobs(limit: int = 5) -> list[dict]:
-    """Atomically claim pending jobs from video_queue (sets status=downloading)."""
+# Rate limit / gateway statuses — retried whatever the body says, since a JSON
+# 429 or a PGRST-coded 503 (pool exhausted) carries no Postgres SQLSTATE
+_RETRYABLE_HTTP_STATUS = frozenset({429, 502, 503, 504})
+# The subset where the request never reached Postgres (rate limited, or no
+# pool connection to run it on) — the only statuses safe to replay for a
+# non-idempotent RPC. A 502/504 may come back after the function committed.
+_NOT_EXECUTED_HTTP_STATUS = frozenset({429, 503})
+
+
+def _is_retryable_db_error(exc: Exception, status_code: Optional[int] = None, idempotent: bool = True) -> bool:
+    """
+    True for transient Supabase failures worth retrying: network errors,
+    HTTP 429/502/503/504 from the gateway, and Postgres connection/resource/
+    serialization errors surfaced by PostgREST.
+
+    With idempotent=False only failures where the request cannot have run
+    are retried: connect errors/timeouts and HTTP 429/503. A read timeout or
+    gateway error may land after the server already applied the call.
+    """
+    if not idempotent:
+        return status_code in _NOT_EXECUTED_HTTP_STATUS or isinstance(
+            exc, (httpx.ConnectError, httpx.ConnectTimeout)
+        )
+    if status_code in _RETRYABLE_HTTP_STATUS:
+        return True
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, APIError):
+        code = str(exc.code or "")
+        return code[:2] in ("08", "53", "57") or code in ("40001", "40P01")
+    return False
+
+
+def _backoff_delay(attempt: int, base: float = 1.0, cap: float = 32.0) -> float:
+    """Exponential backoff + jitter: min(base * 2^attempt + U(0, 0.5), cap) seconds."""
+    return min(base * 2 ** attempt + random.random() * 0.5, cap)
+
+
+async def _postgrest(method: str, path: str, max_retries: int = 5, idempotent: bool = True, **kwargs):
+    """
+    Send a request on the async PostgREST client and return the decoded JSON.
+    Errors are raised as postgrest APIError (same shape supabase-py raises);
+    transient ones are retried with _backoff_delay between attempts.
+    Pass idempotent=False for calls that must not be replayed once they may
+    have run (see _is_retryable_db_error).
+    """
+    for attempt in range(max_retries + 1):
+        status_code: Optional[int] = None
+        try:
+            resp = await _supabase_http.request(method, path, **kwargs)
+            status_code = resp.status_code
+            if status_code < 400:
+                return resp.json() if resp.content else None
+            try:
+                error = resp.json()
+            except ValueError:
+                error = None
+            if not isinstance(error, dict):
+                error = {"message": resp.text, "code": str(status_code), "hint": None, "details": None}
+            raise APIError(error)
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable_db_error(e, status_code, idempotent):
+                raise
+            wait = _backoff_delay(attempt)
+            log.warning(f"[Queue] Supabase transient error ({e}), retry {attempt + 1}/{max_retries} in {wait:.1f}s...")
+            await asyncio.sleep(wait)
+
+
+async def _rpc(fn_name: str, params: dict, idempotent: bool = True):
+    """POST /rpc/{fn_name} through _postgrest."""
+    return await _postgrest("POST", f"/rpc/{fn_name}", idempotent=idempotent, json=params)
+
+
+async def claim_pending_jobs(
+    limit: int = 5, skip_keys: Optional[list[str]] = None, only_keys: Optional[list[str]] = None
+) -> list[dict]:
+    """
+    Atomically claim pending jobs from video_queue (sets status=downloading).
+    Rows whose key is in skip_keys are left pending — they are already
+    in flight here, so claiming them would only strand them in 'downloading'.
+    only_keys, if given, restricts the claim to those keys.
+    Not idempotent: a replay after the first claim committed would claim a
+    second set and strand the first, so only never-executed errors are retried.
+    """
+    params = {"p_limit": limit, "p_skip_keys": skip_keys or []}
+    if only_keys is not None:
+        params["p_only_keys"] = only_keys
     try:
-        result = supabase.rpc("claim_pending_videos", {"p_limit": limit}).execute()
-        return result.data or []
+        jobs = await _rpc("claim_pending_videos", params, idempotent=False) or []
+        for job in jobs:
+            job["_key"] = _job_key(job["mal_id"], job["episode"], job["provider"], job.get("resolution"))
+        return jobs
     except Exception as e:
         log.error(f"[Queue] claim_pending_jobs failed: {e}")
         return []
 
 
-def update_queue_status(job_id: str, status: str, error: Optional[str] = None) -> None:
-    """Update the status of a video_queue entry."""
+async def update_queue_status(job_id: str, status: str, error: Optional[str] = None) -> None:
+    """
+    Update the status of a video_queue entry. A "failed" write bumps
+    retry_count, so it is not replayed once it may have run.
+    """
     try:
-        supabase.rpc(
+        await _rpc(
             "update_video_queue_status",
             {"p_id": job_id, "p_status": status, "p_error": error},
-        ).execute()
+            idempotent=status != "failed",
+        )
     except Exception as e:
         log.error(f"[Queue] update_queue_status failed: {e}")
 
 
-def upsert_video_store(
+# Non-terminal transitions (downloading/uploading) are coalesced per job and
+# flushed in one RPC every _STATUS_FLUSH_INTERVAL seconds. Terminal transitions
+# (ready/failed) skip the batch and are written immediately for durability;
+# the batch RPC never touches ready/failed rows, so a late flush can't undo them.
+_pending_status: dict[str, str] = {}
+_pending_status_event = asyncio.Event()
+_STATUS_FLUSH_INTERVAL = 0.5  # seconds
+
+
+async def update_queue_status_batch(updates: dict[str, str]) -> None:
+    """Apply many status updates (job_id → status) with a single RPC."""
+    try:
+        payload = {"p_updates": [{"id": job_id, "status": status} for job_id, status in updates.items()]}
+        await _rpc("update_video_queue_status_batch", payload)
+    except Exception as e:
+        log.error(f"[Queue] update_queue_status_batch failed: {e}")
+
+
+def queue_status_update(job_id: str, status: str) -> None:
+    """Schedule a non-terminal status update for the next batch flush."""
+    _pending_status[job_id] = status
+    _pending_status_event.set()
+
+
+async def write_terminal_status(job_id: str, status: str, error: Optional[str] = None) -> None:
+    """
+    Write a terminal status (ready/failed) right away. Any batched update for
+    the same job is dropped; one already in flight is ignored by
+    update_video_queue_status_batch once the row is ready/failed.
+    """
+    _pending_status.pop(job_id, None)
+    await update_queue_status(job_id, status, error)
+
+
+async def status_flusher() -> None:
+    """Background task: flush coalesced non-terminal status updates."""
+    while True:
+        await _pending_status_event.wait()
+        await asyncio.sleep(_STATUS_FLUSH_INTERVAL)  # let more updates pile up
+        _pending_status_event.clear()
+        if not _pending_status:
+            continue
+        batch = dict(_pending_status)
+        _pending_status.clear()
+        await update_queue_status_batch(batch)
+
+
+async def upsert_video_store(
     mal_id: int,
     episode: int,
     provider: str,
@@ -618,22 +1129,21 @@ def upsert_video_store(
     stream_url: str,
 ) -> None:
     """Save completed upload info to video_store and mark queue entry as ready."""
+    params = {
+        "p_mal_id": mal_id,
+        "p_episode": episode,
+        "p_provider": provider,
+        "p_resolution": resolution,
+        "p_file_key": file_key,
+        "p_hf_account": hf_account,
+        "p_hf_repo": hf_repo,
+        "p_hf_path": hf_path,
+        "p_hf_direct_url": hf_direct_url,
+        "p_stream_url": stream_url,
+    }
     try:
-        supabase.rpc(
-            "upsert_video_store",
-            {
-                "p_mal_id": mal_id,
-                "p_episode": episode,
-                "p_provider": provider,
-                "p_resolution": resolution,
-                "p_file_key": file_key,
-                "p_hf_account": hf_account,
-                "p_hf_repo": hf_repo,
-                "p_hf_path": hf_path,
-                "p_hf_direct_url": hf_direct_url,
-                "p_stream_url": stream_url,
-            },
-        ).execute()
+        await _rpc("upsert_video_store", params)
+        _ready_keys.add(_job_key(mal_id, episode, provider, resolution))
         log.info(f"  ✅ video_store upserted: mal={mal_id} ep={episode} provider={provider}")
     except Exception as e:
         log.error(f"[Queue] upsert_video_store failed: {e}")
@@ -641,6 +1151,149 @@ def upsert_video_store(
 
 # ── Core processing ───────────────────────────────────────────────────────────
 
+class _BufferReader(io.BufferedIOBase):
+    """
+    Read-only, seekable file object over an in-memory payload, without copying
+    it. CommitOperationAdd only takes bytes or file objects, and bytes() of
+    the Mega buffer would double peak memory. Each upload needs its own
+    position, so every account gets a fork() over the same buffer.
+    """
+
+    def __init__(self, buf: Union[bytearray, memoryview]) -> None:
+        super().__init__()
+        self._view = memoryview(buf).toreadonly()
+        self._pos = 0
+
+    def fork(self) -> "_BufferReader":
+        return _BufferReader(self._view)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = self._view[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return data
+
+    read1 = read
+
+    def readinto(self, b) -> int:
+        data = self._view[self._pos:self._pos + len(b)]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+_MIN_TMP_FREE_BYTES = 2 * 1024 ** 3  # 2GB
+# RAM a job on /dev/shm may pin: the episode file, twice over while an HLS
+# join holds segments and output together. tmpfs pages count against the
+# Space's memory cgroup, so a new job only goes to /dev/shm when the memory
+# left could hold this much for it. Jobs already on /dev/shm are counted in
+# memory.current, so only the new job's reserve is needed.
+_SHM_JOB_RESERVE_BYTES = 2 * _MIN_TMP_FREE_BYTES
+
+
+def _memory_headroom() -> Optional[int]:
+    """
+    Bytes left under the cgroup v2 memory limit; with no limit set (or no
+    cgroup v2), the host's MemAvailable instead. None if neither is readable.
+    """
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            with open("/sys/fs/cgroup/memory.current") as f:
+                return int(limit) - int(f.read())
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _pick_tmp_base() -> tuple[Optional[str], float]:
+    """
+    Pick where a job's temp dir goes: /dev/shm (RAM-backed, so the file the
+    uploads read back is already in memory) when there is room for another
+    _SHM_JOB_RESERVE_BYTES of RAM, else /tmp (2GB free required).
+    shutil.disk_usage on /dev/shm reports the tmpfs size, not the cgroup
+    limit, so it alone can't tell whether RAM is actually available.
+    Returns (directory, free GB), or (None, free GB of /tmp) if neither has room.
+    """
+    headroom = _memory_headroom()
+    if headroom is not None and headroom >= _SHM_JOB_RESERVE_BYTES:
+        try:
+            free = shutil.disk_usage("/dev/shm").free
+            if free >= _MIN_TMP_FREE_BYTES:
+                return "/dev/shm", free / (1024 ** 3)
+        except OSError:
+            pass
+    try:
+        free = shutil.disk_usage("/tmp").free
+    except OSError:
+        return None, 0.0
+    if free >= _MIN_TMP_FREE_BYTES:
+        return "/tmp", free / (1024 ** 3)
+    return None, free / (1024 ** 3)
+
+
+def _fast_rmtree(path: str) -> None:
+    """
+    Remove a job temp dir (a video file, maybe a few part files) with one
+    scandir pass instead of rmtree's walk. Errors are ignored, like
+    rmtree(ignore_errors=True).
+    """
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        _fast_rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def _cleanup_job_tmp(tmpdir: str, tmp_file: str) -> None:
+    """
+    Remove the job's single output file and its dir (unlink + rmdir). Falls
+    back to _fast_rmtree if anything else was left behind (aria2c control
+    files, HLS segments).
+    """
+    try:
+        os.unlink(tmp_file)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        _fast_rmtree(tmpdir)
+        return
+    try:
+        os.rmdir(tmpdir)
+    except OSError:
+        _fast_rmtree(tmpdir)
+
+
 def build_hf_direct_url(username: str, hf_path: str) -> str:
     """
     Build the HuggingFace raw download URL for a dataset file.
@@ -650,6 +1303,79 @@ def build_hf_direct_url(username: str, hf_path: str) -> str:
     return f"https://huggingface.co/datasets/{username}/weaboo-storage/resolve/main/{hf_path}"
 
 
+# build_hf_direct_url(username, "") per account — the URL is prefix + hf_path
+_hf_direct_url_prefixes: list[str] = [build_hf_direct_url(username, "") for username in HF_USERNAMES]
+
+# Attempts at create_commit when it fails with 412 (branch moved under us)
+_COMMIT_MAX_RETRIES = 3
+
+
+async def _upload_one(
+    account_idx: int, template: CommitOperationAdd, hf_path: str, commit_msg: str
+) -> tuple[int, bool, str]:
+    """
+    Upload the downloaded video to a single storage account. template is the
+    job's CommitOperationAdd, already hashed; each account commits a copy so
+    the per-commit upload state stays separate.
+    Returns (account_idx, success, hf_direct_url). Never raises — a failed
+    account is logged and reported as unsuccessful so the others carry on.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        api = get_hf_api(account_idx)
+        # single global repo per account; get_repo_id raises the config error if unset
+        repo_id = _repo_ids[account_idx] or get_repo_id(account_idx)
+
+        if (account_idx, repo_id) not in _known_repos:
+            await loop.run_in_executor(_upload_executor, ensure_repo_exists, api, repo_id, False)
+            _known_repos.add((account_idx, repo_id))
+
+        log.info(f"  ⬆️  Uploading to account {account_idx + 1}: {repo_id}/{hf_path}")
+
+        # LFS upload first, outside the lock — blobs are content-addressed and
+        # can't conflict, so uploads to the same repo run in parallel.
+        operation = copy.copy(template)
+        if isinstance(template.path_or_fileobj, _BufferReader):
+            operation.path_or_fileobj = template.path_or_fileobj.fork()
+        await loop.run_in_executor(
+            _upload_executor,
+            functools.partial(api.preupload_lfs_files, repo_id, [operation], repo_type="dataset"),
+        )
+
+        # Per-repo lock only around the commit: concurrent commits to the same
+        # repo cause 412 Precondition Failed (Git merge conflict).
+        repo_lock = _repo_locks.get((account_idx, repo_id))
+        async with repo_lock:
+            for attempt in range(_COMMIT_MAX_RETRIES):
+                try:
+                    await loop.run_in_executor(
+                        _upload_executor,
+                        functools.partial(
+                            api.create_commit,
+                            repo_id,
+                            [operation],
+                            commit_message=commit_msg,
+                            repo_type="dataset",
+                        ),
+                    )
+                    break
+                except HfHubHTTPError as e:
+                    status_code = e.response.status_code if e.response is not None else None
+                    if status_code != 412 or attempt == _COMMIT_MAX_RETRIES - 1:
+                        raise
+                    # Another writer (e.g. a second Space) moved the branch —
+                    # retry the commit; the preuploaded blob is reused.
+                    log.warning(f"  ⚠️  412 on commit to {repo_id}, retrying ({attempt + 1}/{_COMMIT_MAX_RETRIES})")
+                    await asyncio.sleep(1 + attempt)
+
+        log.info(f"  ✅ Upload complete: account {account_idx + 1} → {repo_id}/{hf_path}")
+        return account_idx, True, _hf_direct_url_prefixes[account_idx] + hf_path
+
+    except Exception as e:
+        log.error(f"  ❌ Upload failed for account {account_idx + 1}: {e}")
+        return account_idx, False, ""
+
+
 async def process_job(job: dict) -> None:
     """
     Process a single video_queue job end-to-end:
@@ -659,120 +1385,102 @@ async def process_job(job: dict) -> None:
       4. Explicitly mark queue as ready in case job_id is a real UUID
       5. Clean up temp file
     """
-    job_id: Optional[str] = job.get("id")  # may be None for webhook-triggered jobs without DB row
+    job_id: Optional[str] = job.get("id")  # set for claimed rows; None skips queue status updates
     mal_id: int = job["mal_id"]
     episode: int = job["episode"]
     provider: str = job["provider"]
     video_url: str = job["video_url"]
     resolution: Optional[str] = job.get("resolution")
 
-    # Helper: only call update_queue_status if we have a real UUID
-    def _update_status(status: str, error: Optional[str] = None) -> None:
-        if job_id is not None:
-            update_queue_status(job_id, status, error)
+    # Helper: only update the queue if we have a real UUID
+    async def _update_status(status: str, error: Optional[str] = None) -> None:
+        if job_id is None:
+            return
+        if status in ("ready", "failed"):
+            await write_terminal_status(job_id, status, error)
+        else:
+            queue_status_update(job_id, status)
 
     log.info(f"🎬 Processing: mal={mal_id} ep={episode} provider={provider} res={resolution or 'unknown'} id={job_id or 'webhook'}")
 
     # Guard: check available disk space before downloading
     # HF Space /tmp is limited — abort early if < 2GB free to avoid disk full crashes
-    import shutil as _shutil
-    disk = _shutil.disk_usage("/tmp")
-    free_gb = disk.free / (1024 ** 3)
-    if free_gb < 2.0:
+    tmp_base, free_gb = _pick_tmp_base()
+    if tmp_base is None:
         log.error(f"  ❌ Insufficient disk space: {free_gb:.1f}GB free (need 2GB)")
-        _update_status("failed", f"Insufficient disk space: {free_gb:.1f}GB free")
+        await _update_status("failed", f"Insufficient disk space: {free_gb:.1f}GB free")
         return
 
     file_key = make_file_key(mal_id, episode, provider, resolution)
     ext = "mp4"  # Always output as mp4 (ffmpeg converts HLS segments to MP4 container)
+    is_hls = "m3u8" in video_url.casefold()
 
     if not _valid_accounts:
         log.error("  ❌ No storage accounts configured")
-        _update_status("failed", "No storage accounts configured")
+        await _update_status("failed", "No storage accounts configured")
         return
 
-    # ── Step 1: Download to temp file (once, then upload to all accounts) ────
-    tmpdir = tempfile.mkdtemp(prefix="weaboo_")
+    # ── Step 1: Download once (temp file, or memory for Mega), then upload ──
+    tmpdir = tempfile.mkdtemp(prefix="weaboo_", dir=tmp_base)
     tmp_file = os.path.join(tmpdir, f"{file_key}.{ext}")
 
     try:
-        _update_status("downloading")
-        success = await asyncio.get_event_loop().run_in_executor(
-            None, download_with_aria2c, video_url, tmp_file
-        )
+        await _update_status("downloading")
+        payload = await download_with_aria2c(video_url, tmp_file, is_hls)
 
-        if not success or not os.path.exists(tmp_file):
+        if payload is None:
             raise RuntimeError("Download failed or output file missing")
 
-        file_size_mb = os.path.getsize(tmp_file) / (1024 * 1024)
-        log.info(f"  📁 Downloaded: {file_size_mb:.1f} MB → {tmp_file}")
+        if isinstance(payload, bytearray):
+            log.info(f"  📁 Downloaded: {len(payload) / (1024 * 1024):.1f} MB (in memory)")
+        else:
+            log.info(f"  📁 Downloaded: {os.path.getsize(payload) / (1024 * 1024):.1f} MB → {payload}")
 
         # ── Step 2: Upload to ALL storage accounts (backup/redundancy) ────────
-        _update_status("uploading")
+        await _update_status("uploading")
         hf_path = make_hf_path(mal_id, episode, file_key, False)
 
-        # Track which account to use as primary for video_store
+        commit_msg = f"weaboo: add ep{episode} ({provider})"
+
+        # Hash once for all accounts — CommitOperationAdd reads the whole payload
+        # for its LFS sha256 on construction, so building one per account would
+        # re-read the file len(_valid_accounts) times.
+        source = _BufferReader(payload) if isinstance(payload, bytearray) else payload
+        template = await asyncio.to_thread(CommitOperationAdd, path_in_repo=hf_path, path_or_fileobj=source)
+
+        # Fan out to every account at once — uploads are independent, so wall
+        # time is the slowest upload instead of the sum of all of them.
+        # Primary for video_store = first account to finish successfully; it is
+        # upserted right away while the other uploads keep running.
+        # The SQL RPC also marks video_queue status=ready for this mal/ep/provider/res.
         primary_uploaded = False
         upload_success_count = 0
-
-        for account_idx in _valid_accounts:
+        for next_done in asyncio.as_completed(
+            [_upload_one(idx, template, hf_path, commit_msg) for idx in _valid_accounts]
+        ):
             try:
-                api = get_hf_api(account_idx)
-                repo_id = get_repo_id(account_idx)  # single global repo per account
-                username = HF_USERNAMES[account_idx]
-
-                await asyncio.get_event_loop().run_in_executor(
-                    None, ensure_repo_exists, api, repo_id, False
-                )
-
-                log.info(f"  ⬆️  Uploading to account {account_idx + 1}: {repo_id}/{hf_path}")
-
-                # Capture loop variables explicitly to avoid closure capture bug
-                _tmp_file = tmp_file
-                _hf_path = hf_path
-                _commit_msg = f"weaboo: add ep{episode} ({provider})"
-
-                # Per-repo lock: serialize uploads to the same repo to prevent
-                # 412 Precondition Failed (Git merge conflict from concurrent commits).
-                repo_lock = await _get_repo_lock(account_idx, repo_id)
-                async with repo_lock:
-                    await asyncio.get_event_loop().run_in_executor(
-                        None,
-                        lambda _api=api, _repo_id=repo_id: _api.upload_file(
-                            path_or_fileobj=_tmp_file,
-                            path_in_repo=_hf_path,
-                            repo_id=_repo_id,
-                            repo_type="dataset",
-                            commit_message=_commit_msg,
-                        ),
-                    )
-
-                log.info(f"  ✅ Upload complete: account {account_idx + 1} → {repo_id}/{hf_path}")
-                upload_success_count += 1
-
-                # upsert_video_store only for the first successful account (primary).
-                # The SQL RPC also marks video_queue status=ready for this mal/ep/provider/res.
-                if not primary_uploaded:
-                    hf_direct_url = build_hf_direct_url(username, hf_path)
-                    stream_url = make_stream_url(hf_direct_url)
-                    upsert_video_store(
-                        mal_id=mal_id,
-                        episode=episode,
-                        provider=provider,
-                        resolution=resolution,
-                        file_key=file_key,
-                        hf_account=account_idx + 1,
-                        hf_repo=repo_id,
-                        hf_path=hf_path,
-                        hf_direct_url=hf_direct_url,
-                        stream_url=stream_url,
-                    )
-                    primary_uploaded = True
-                    log.info(f"  📦 video_store upserted (primary account {account_idx + 1})")
-
+                account_idx, ok, hf_direct_url = await next_done
             except Exception as e:
-                log.error(f"  ❌ Upload failed for account {account_idx + 1}: {e}")
-                # Continue to next account — don't stop all uploads
+                log.error(f"  ❌ Upload task crashed: {e}")
+                continue
+            if not ok:
+                continue
+            upload_success_count += 1
+            if not primary_uploaded:
+                await upsert_video_store(
+                    mal_id=mal_id,
+                    episode=episode,
+                    provider=provider,
+                    resolution=resolution,
+                    file_key=file_key,
+                    hf_account=account_idx + 1,
+                    hf_repo=_repo_ids[account_idx],
+                    hf_path=hf_path,
+                    hf_direct_url=hf_direct_url,
+                    stream_url=make_stream_url(hf_direct_url),
+                )
+                primary_uploaded = True
+                log.info(f"  📦 video_store upserted (primary account {account_idx + 1})")
 
         if not primary_uploaded:
             raise RuntimeError("Upload failed for all storage accounts")
@@ -781,130 +1489,258 @@ async def process_job(job: dict) -> None:
         # upsert_video_store already marked queue as ready via SQL.
         # Explicitly update status in case job_id is a real UUID from webhook
         # (upsert_video_store uses mal/ep/provider/res match, not job_id).
-        _update_status("ready")
+        await _update_status("ready")
 
     except Exception as e:
         log.error(f"  ❌ Job failed (mal={mal_id} ep={episode}): {e}")
-        _update_status("failed", str(e)[:500])
+        await _update_status("failed", str(e)[:500])
 
     finally:
         # Always clean up temp directory
-        shutil.rmtree(tmpdir, ignore_errors=True)
+        await asyncio.to_thread(_cleanup_job_tmp, tmpdir, tmp_file)
         log.debug(f"  🗑️  Cleaned up temp dir: {tmpdir}")
 
 
 # ── Background polling worker ─────────────────────────────────────────────────
 
-# Semaphore to limit concurrent jobs (avoid OOM on large video files)
-_job_semaphore = asyncio.Semaphore(5)
+# Semaphore to limit concurrent jobs (avoid OOM on large video files).
+# Each poll claims up to the same number, so one claim can fill every slot.
+_job_semaphore = asyncio.Semaphore(_MAX_CONCURRENT_JOBS)
+
+# Claimed jobs wait here for one of the _MAX_CONCURRENT_JOBS long-lived
+# consumers. The bound gives the poller back-pressure: put() blocks once a
+# full batch is already waiting, so it never claims far ahead of capacity.
+_job_queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=_MAX_CONCURRENT_JOBS)
+# Consumer capacity not yet spoken for: reserved before a claim RPC (unused
+# reservations refunded after it), given back when a consumer finishes a job.
+# Claims ask for exactly this many and are skipped at zero, so a saturated
+# worker makes no claim RPCs. Reserving before the await keeps concurrent
+# claimers from over-claiming; only touched on the event loop, so no lock.
+_free_slots = _MAX_CONCURRENT_JOBS
 
 # In-memory set of job keys currently being processed.
 # Prevents duplicate concurrent processing of the same (mal_id, episode, provider, resolution).
-_active_job_keys: set[str] = set()
-_active_job_keys_lock = asyncio.Lock()
+# Only touched from the event loop with no await between check and add, so no
+# lock is needed.
+_active_job_keys: set[tuple[int, int, str, str]] = set()
 
-# Per-repo upload locks — prevents concurrent uploads to the same HF repo
-# which cause 412 Precondition Failed (Git merge conflict).
-# Key: "{account_idx}:{repo_id}", Value: asyncio.Lock()
-_repo_locks: dict[str, asyncio.Lock] = {}
-_repo_locks_meta = asyncio.Lock()
+# Job keys this worker has upserted to video_store. ready is terminal —
+# enqueue_video only revives failed rows — so /trigger can drop a hit without
+# queueing it for a claim.
+_ready_keys: set[tuple[int, int, str, str]] = set()
+
+
+def _job_key(mal_id: int, episode: int, provider: str, resolution: Optional[str]) -> tuple[int, int, str, str]:
+    """Dedup key, computed once when the job dict is built and stored as job["_key"]."""
+    return (mal_id, episode, provider, resolution or "")
+
+
+def _key_param(key: tuple[int, int, str, str]) -> str:
+    """A job key in the "mal_id:episode:provider:resolution" form claim_pending_videos expects."""
+    return "{}:{}:{}:{}".format(*key)
+
+
+def _skip_keys_param() -> list[str]:
+    """_active_job_keys as claim_pending_videos' p_skip_keys."""
+    return [_key_param(key) for key in _active_job_keys]
+
+
+class _KeyedLock:
+    """
+    asyncio.Lock per key, held weakly: a key's lock disappears once no
+    uploader references it, so the map doesn't grow with every repo ever seen.
+    Lookup-and-insert has no await, so it is atomic on the event loop.
+    """
+
+    def __init__(self) -> None:
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
 
+    def get(self, key: Hashable) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
 
-async def _get_repo_lock(account_idx: int, repo_id: str) -> asyncio.Lock:
-    """Get or create a per-repo asyncio lock to serialize uploads to the same repo."""
-    key = f"{account_idx}:{repo_id}"
-    async with _repo_locks_meta:
-        if key not in _repo_locks:
-            _repo_locks[key] = asyncio.Lock()
-        return _repo_locks[key]
+
+# Per-repo upload locks — prevents concurrent commits to the same HF repo
+# which cause 412 Precondition Failed (Git merge conflict).
+# Key: (account_idx, repo_id)
+_repo_locks = _KeyedLock()
 
 
 _is_running = False
 
+# Set by the video_queue_new NOTIFY listener whenever a job becomes pending.
+_job_event = asyncio.Event()
+_QUEUE_CHANNEL = "video_queue_new"
+_POLL_INTERVAL = 5          # seconds, when no listener is available
+_WATCHDOG_INTERVAL = 60     # seconds, safety-net poll for missed notifications
+
+
+# True while queue_listener holds a live LISTEN connection
+_listener_connected = False
+
+
+async def queue_listener() -> None:
+    """
+    Background task: keep a dedicated Postgres connection LISTENing on
+    video_queue_new, reconnecting with backoff whenever it drops. The
+    connection is pinged every watchdog interval so a silently dead socket
+    is noticed too. While disconnected the worker falls back to polling.
+    """
+    global _listener_connected
+    delay = 1
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(SUPABASE_DB_URL)
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _conn: lost.set())
+            await conn.add_listener(_QUEUE_CHANNEL, lambda *_: _job_event.set())
+            _listener_connected = True
+            delay = 1
+            log.info(f"📡 LISTEN {_QUEUE_CHANNEL} connected")
+            _job_event.set()  # claim anything enqueued while we were disconnected
+
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), timeout=_WATCHDOG_INTERVAL)
+                except asyncio.TimeoutError:
+                    await conn.execute("SELECT 1", timeout=10)
+            log.warning(f"⚠️  LISTEN {_QUEUE_CHANNEL} connection lost — reconnecting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning(f"⚠️  LISTEN {_QUEUE_CHANNEL} unavailable, polling every {_POLL_INTERVAL}s: {e}")
+        finally:
+            _listener_connected = False
+            if conn is not None and not conn.is_closed():
+                conn.terminate()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, _WATCHDOG_INTERVAL)
+
 
-def reset_stale_jobs() -> None:
+async def reset_stale_jobs() -> None:
     """
     On startup: reset jobs stuck in 'downloading' or 'uploading' back to 'pending'.
     These are jobs that were in-flight when the HF Space last restarted/crashed.
     Without this, they stay stuck forever since no worker will pick them up.
     Max age before considering stuck: 2 hours (generous for large files).
     """
+    import datetime
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cutoff = (now - datetime.timedelta(hours=2)).isoformat()
     try:
-        result = (
-            supabase.table("video_queue")
-            .select("id, status, updated_at")
-            .in_("status", ["downloading", "uploading"])
-            .execute()
+        # Age filter + reset in one UPDATE — rows without updated_at count as stale
+        rows = await _postgrest(
+            "PATCH",
+            "/video_queue",
+            params={
+                "status": "in.(downloading,uploading)",
+                "or": f"(updated_at.lt.{cutoff},updated_at.is.null)",
+            },
+            json={"status": "pending", "updated_at": now.isoformat()},
+            headers={"Prefer": "return=representation"},
         )
-        stale = result.data or []
-        if not stale:
-            return
-
-        import datetime
-        now = datetime.datetime.now(datetime.timezone.utc)
-        reset_count = 0
-        for job in stale:
-            updated = job.get("updated_at")
-            if updated:
-                try:
-                    # Parse ISO timestamp
-                    updated_dt = datetime.datetime.fromisoformat(updated.replace("Z", "+00:00"))
-                    age_minutes = (now - updated_dt).total_seconds() / 60
-                    if age_minutes < 120:
-                        continue  # Still fresh — might be legitimately in progress
-                except Exception:
-                    pass
-
-            # Reset stale job → pending
-            supabase.rpc(
-                "update_video_queue_status",
-                {"p_id": job["id"], "p_status": "pending", "p_error": None},
-            ).execute()
-            reset_count += 1
-
+        reset_count = len(rows or [])
         if reset_count > 0:
             log.info(f"♻️  Reset {reset_count} stale job(s) (downloading/uploading → pending)")
     except Exception as e:
         log.error(f"[Worker] reset_stale_jobs failed: {e}")
 
 
+async def _claim_into_queue(limit: int, only_keys: Optional[list[str]] = None) -> list[dict]:
+    """
+    Claim up to limit pending jobs (capped at _free_slots, restricted to
+    only_keys if given) in one RPC and hand them to the consumers. No RPC
+    when every slot is taken.
+    """
+    global _free_slots
+    limit = min(limit, _free_slots)
+    if limit <= 0:
+        return []
+    # Reserve before the await so a concurrent claimer sees the slots as taken
+    _free_slots -= limit
+    jobs: list[dict] = []
+    try:
+        jobs = await claim_pending_jobs(limit, _skip_keys_param(), only_keys)
+    finally:
+        _free_slots += limit - len(jobs)
+    if jobs:
+        log.info(f"📋 Claimed {len(jobs)} pending job(s)")
+        for job in jobs:
+            await _job_queue.put(job)
+    return jobs
+
+
 async def background_worker() -> None:
     """
-    Polls Supabase video_queue every 5 seconds for pending jobs.
-    Processes up to 20 jobs concurrently (controlled by semaphore).
+    Claims pending jobs from Supabase video_queue whenever a NOTIFY arrives on
+    video_queue_new, with a 60s watchdog poll for missed notifications. Without
+    a live listener (no SUPABASE_DB_URL, or reconnecting) it polls every 5 seconds.
+    Processes up to _MAX_CONCURRENT_JOBS jobs concurrently (controlled by semaphore).
     Runs indefinitely as a background asyncio task.
 
     Scenarios handled:
     - Multiple users fetch same episode → dedup via _active_job_keys
-    - Multiple users fetch different episodes → all process concurrently (≤20)
+    - Multiple users fetch different episodes → all process concurrently (≤_MAX_CONCURRENT_JOBS)
     - HF Space restart mid-job → reset_stale_jobs() on startup resets stuck jobs
     - Mega rate limit → retry with backoff in _download_mega
     - 412 HF conflict → retry with backoff in upload loop
-    - Semaphore overflow (>20 concurrent) → excess jobs stay in queue, picked up next poll
+    - More pending than free consumers → claim only _free_slots jobs; the rest stay in video_queue
+      and are claimed as soon as a consumer finishes
     """
     global _is_running
     _is_running = True
-    log.info("🚀 Background worker started — polling every 5s")
+
+    if SUPABASE_DB_URL:
+        log.info(f"🚀 Background worker started — LISTEN {_QUEUE_CHANNEL} (watchdog every {_WATCHDOG_INTERVAL}s)")
+    else:
+        log.info(f"🚀 Background worker started — polling every {_POLL_INTERVAL}s")
 
     # On startup: recover any jobs stuck from previous instance crash/restart
-    await asyncio.get_event_loop().run_in_executor(None, reset_stale_jobs)
+    await reset_stale_jobs()
 
     while True:
+        # Clear before claiming: a NOTIFY that lands mid-claim re-arms the
+        # event, so the next iteration claims again right away.
+        _job_event.clear()
         try:
-            jobs = await asyncio.get_event_loop().run_in_executor(None, claim_pending_jobs, 5)
-
-            if jobs:
-                log.info(f"📋 Claimed {len(jobs)} pending job(s)")
-                tasks = [_run_with_semaphore(job) for job in jobs]
-                # gather concurrent — semaphore limits actual concurrency to 20
-                await asyncio.gather(*tasks, return_exceptions=True)
+            if _free_slots <= 0:
+                # Saturated: a finishing consumer sets _job_event to wake us
+                log.debug("⏸️  All job slots busy — not claiming")
             else:
-                log.debug("⏳ No pending jobs")
+                limit = _free_slots
+                jobs = await _claim_into_queue(limit)
+                if len(jobs) == limit:
+                    continue  # filled every free slot — likely more pending
+                if not jobs:
+                    log.debug("⏳ No pending jobs")
 
         except Exception as e:
             log.error(f"[Worker] Poll cycle error: {e}")
 
-        await asyncio.sleep(5)
+        wait_timeout = _WATCHDOG_INTERVAL if _listener_connected else _POLL_INTERVAL
+        try:
+            await asyncio.wait_for(_job_event.wait(), timeout=wait_timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _job_consumer() -> None:
+    """Long-lived task: run claimed jobs from _job_queue one at a time."""
+    global _free_slots
+    while True:
+        job = await _job_queue.get()
+        try:
+            await _run_with_semaphore(job)
+        except Exception as e:
+            log.error(f"[Worker] Job crashed: {e}")
+        finally:
+            _job_queue.task_done()
+            # Slot is free again — wake the worker to claim any backlog now
+            _free_slots += 1
+            _job_event.set()
 
 
 async def _run_with_semaphore(job: dict) -> None:
@@ -912,36 +1748,84 @@ async def _run_with_semaphore(job: dict) -> None:
     Run a single job with:
     1. Deduplication — skip if the same (mal_id, episode, provider, resolution)
        is already being processed in this instance (e.g. 5 concurrent webhooks).
-    2. Concurrency control — semaphore limits max parallel jobs to 20.
+    2. Concurrency control — semaphore limits max parallel jobs.
     """
-    job_key = f"{job['mal_id']}:{job['episode']}:{job['provider']}:{job.get('resolution')}"
+    job_key = job["_key"]
 
-    async with _active_job_keys_lock:
-        if job_key in _active_job_keys:
-            log.info(f"  ⏭️  Skipping duplicate in-flight job: {job_key}")
-            return
-        _active_job_keys.add(job_key)
+    if job_key in _active_job_keys:
+        log.info(f"  ⏭️  Skipping duplicate in-flight job: {job_key}")
+        return
+    _active_job_keys.add(job_key)
 
     try:
         async with _job_semaphore:
             await process_job(job)
     finally:
-        async with _active_job_keys_lock:
-            _active_job_keys.discard(job_key)
+        _active_job_keys.discard(job_key)
+
+
+# Webhook trigger keys waiting for the next batched claim
+_pending_triggers: set[tuple[int, int, str, str]] = set()
+_trigger_event = asyncio.Event()
+_TRIGGER_BATCH_WINDOW = 0.25  # seconds to let a burst of webhooks pile up
+
+
+async def trigger_batcher() -> None:
+    """
+    Background task: coalesce webhook triggers into at most one claim per
+    window. With the LISTEN connection up, the enqueue's NOTIFY has already
+    woken background_worker, so the batch is only deduplicated — no RPC.
+    Otherwise one claim_pending_videos call restricted to the triggered keys
+    picks up exactly those rows (up to _free_slots). Anything it doesn't
+    claim — row not visible yet, already taken, or no free slot — stays
+    pending in video_queue for the next poll.
+    """
+    while True:
+        await _trigger_event.wait()
+        await asyncio.sleep(_TRIGGER_BATCH_WINDOW)
+        _trigger_event.clear()
+        keys = [key for key in _pending_triggers if key not in _active_job_keys]
+        _pending_triggers.clear()
+        if not keys:
+            continue
+        if _listener_connected:
+            log.debug(f"⚡ {len(keys)} trigger(s) covered by LISTEN — no claim needed")
+            continue
+
+        try:
+            await _claim_into_queue(len(keys), only_keys=[_key_param(key) for key in keys])
+        except Exception as e:
+            log.error(f"[Worker] Trigger batch claim failed: {e}")
 
 
 # ── FastAPI app ───────────────────────────────────────────────────────────────
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Start background worker on app startup."""
-    task = asyncio.create_task(background_worker())
+    """Start background worker, job consumers + status flusher on app startup."""
+    asyncio.get_running_loop().set_default_executor(_default_executor)
+    tasks = [
+        asyncio.create_task(background_worker()),
+        asyncio.create_task(status_flusher()),
+        asyncio.create_task(trigger_batcher()),
+        *(asyncio.create_task(_job_consumer()) for _ in range(_MAX_CONCURRENT_JOBS)),
+        asyncio.create_task(_prewarm_repo_cache()),
+    ]
+    if SUPABASE_DB_URL:
+        tasks.append(asyncio.create_task(queue_listener()))
     yield
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await _supabase_http.aclose()
+    _download_executor.shutdown(wait=False, cancel_futures=True)
+    _upload_executor.shutdown(wait=False, cancel_futures=True)
+    _db_executor.shutdown(wait=False, cancel_futures=True)
+    _default_executor.shutdown(wait=False, cancel_futures=True)
 
 
 app = FastAPI(
@@ -949,13 +1833,14 @@ app = FastAPI(
     description="Background video download + HuggingFace upload worker for Weaboo API",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 
 @app.get("/")
-async def root() -> JSONResponse:
+async def root() -> ORJSONResponse:
     """Root endpoint — satisfies HuggingFace Space health check."""
-    return JSONResponse({
+    return ORJSONResponse({
         "name": "weaboo-worker",
         "status": "ok",
         "worker_running": _is_running,
@@ -963,9 +1848,9 @@ async def root() -> JSONResponse:
 
 
 @app.get("/health")
-async def health() -> JSONResponse:
+async def health() -> ORJSONResponse:
     """Health check — confirms the Space is awake and worker is running."""
-    return JSONResponse({
+    return ORJSONResponse({
         "status": "ok",
         "worker_running": _is_running,
         "storage_accounts": len(_valid_accounts),
@@ -976,9 +1861,8 @@ async def health() -> JSONResponse:
 @app.post("/trigger")
 async def trigger(
     request: Request,
-    background_tasks: BackgroundTasks,
     credentials: HTTPAuthorizationCredentials = Security(_bearer_scheme),
-) -> JSONResponse:
+) -> ORJSONResponse:
     """
     Realtime webhook trigger called by Weaboo API after enqueuing a video.
     Requires Authorization: Bearer <WEBHOOK_SECRET> header.
@@ -999,7 +1883,7 @@ async def trigger(
             raise HTTPException(status_code=401, detail="Invalid or missing webhook secret")
 
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON body")
 
@@ -1015,80 +1899,58 @@ async def trigger(
     if provider not in ("animasu", "samehadaku"):
         raise HTTPException(status_code=400, detail="provider must be 'animasu' or 'samehadaku'")
 
+    try:
+        mal_id, episode = int(mal_id), int(episode)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="mal_id and episode must be integers")
+
     log.info(f"⚡ Webhook trigger: mal={mal_id} ep={episode} provider={provider}")
 
-    # Check if this job is already claimed/processing (avoid duplicate work)
-    try:
-        existing = (
-            supabase.table("video_queue")
-            .select("status")
-            .eq("mal_id", mal_id)
-            .eq("episode", episode)
-            .eq("provider", provider)
-            .eq("resolution", resolution)
-            .maybe_single()
-            .execute()
-        )
-        if existing.data and existing.data.get("status") in ("downloading", "uploading", "ready"):
-            log.info(f"  ⏭️  Job already {existing.data['status']} — skipping trigger")
-            return JSONResponse({"queued": False, "reason": existing.data["status"]})
-    except Exception:
-        pass  # Safe to proceed even if status check fails
+    key = _job_key(mal_id, episode, provider, resolution)
+    if key in _ready_keys:
+        log.info(f"  ⏭️  Already ready — skipping trigger: {key}")
+        return ORJSONResponse({"queued": False, "reason": "ready", "mal_id": mal_id, "episode": episode, "provider": provider})
+
+    # Hand off to trigger_batcher so we return 200 immediately to the caller.
+    # The job itself is the queue row enqueue_video wrote, claimed by key — a
+    # burst of webhooks shares one claim RPC (none while LISTEN is up).
+    _pending_triggers.add(key)
+    _trigger_event.set()
+
+    return ORJSONResponse({"queued": True, "mal_id": mal_id, "episode": episode, "provider": provider})
 
-    # Fetch the actual queue entry ID so process_job can update status correctly.
-    # The entry must already exist (enqueue_video was called by Weaboo API before trigger).
-    # If not found yet (race condition), fall back to a sentinel that process_job will handle.
-    try:
-        queue_row = (
-            supabase.table("video_queue")
-            .select("id")
-            .eq("mal_id", mal_id)
-            .eq("episode", episode)
-            .eq("provider", provider)
-            .eq("resolution", resolution)
-            .maybe_single()
-            .execute()
-        )
-        real_id = queue_row.data["id"] if queue_row.data else None
-    except Exception:
-        real_id = None
-
-    job = {
-        "id": real_id,  # real UUID or None — process_job skips status update if None
-        "mal_id": mal_id,
-        "episode": episode,
-        "provider": provider,
-        "video_url": video_url,
-        "resolution": resolution,
-    }
 
-    # Run in background so we return 200 immediately to the caller
-    background_tasks.add_task(_run_with_semaphore, job)
+# Last /status body: (monotonic timestamp, body). Dashboards poll it; counts a
+# few seconds old are fine and spare two Supabase round trips per request.
+_status_cache: Optional[tuple[float, dict]] = None
+_STATUS_CACHE_TTL = 5  # seconds
 
-    return JSONResponse({"queued": True, "mal_id": mal_id, "episode": episode, "provider": provider})
+
+def _fetch_status() -> dict:
+    """Queue counts + archived total from Supabase. Blocking — run in _db_executor."""
+    # Counted in SQL (GROUP BY status) — only the buckets cross the wire
+    result = supabase.rpc("get_video_queue_counts").execute()
+    counts: dict[str, int] = result.data or {}
+
+    store_result = supabase.table("video_store").select("id", count="exact").execute()
+    archived_count = store_result.count or 0
+
+    return {
+        "queue": counts,
+        "archived": archived_count,
+    }
 
 
 @app.get("/status")
-async def status() -> JSONResponse:
-    """Return current queue statistics from Supabase."""
+async def status() -> ORJSONResponse:
+    """Return current queue statistics from Supabase (cached for _STATUS_CACHE_TTL seconds)."""
+    global _status_cache
+    now = time.monotonic()
+    if _status_cache is not None and now - _status_cache[0] < _STATUS_CACHE_TTL:
+        return ORJSONResponse(_status_cache[1])
     try:
-        result = (
-            supabase.table("video_queue")
-            .select("status")
-            .execute()
-        )
-        rows = result.data or []
-        counts: dict[str, int] = {}
-        for row in rows:
-            s = row.get("status", "unknown")
-            counts[s] = counts.get(s, 0) + 1
-
-        store_result = supabase.table("video_store").select("id", count="exact").execute()
-        archived_count = store_result.count or 0
-
-        return JSONResponse({
-            "queue": counts,
-            "archived": archived_count,
-        })
+        body = await asyncio.get_running_loop().run_in_executor(_db_executor, _fetch_status)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    _status_cache = (now, body)
+    return ORJSONResponse(body)
@@ -366,10 +366,46 @@ BEGIN
 END;
 $$;
 
+-- ============================================================
+-- TRIGGER: notify_video_queue_pending
+-- Kirim NOTIFY 'video_queue_new' setiap kali ada entry yang jadi 'pending'
+-- (insert baru, atau failed → pending lewat enqueue_video), supaya worker
+-- langsung claim tanpa menunggu polling.
+-- ============================================================
+CREATE OR REPLACE FUNCTION notify_video_queue_pending()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF NEW.status = 'pending'
+     AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'pending') THEN
+    PERFORM pg_notify('video_queue_new', NEW.id::text);
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_video_queue_notify_pending ON video_queue;
+CREATE TRIGGER trg_video_queue_notify_pending
+  AFTER INSERT OR UPDATE OF status ON video_queue
+  FOR EACH ROW
+  EXECUTE FUNCTION notify_video_queue_pending();
+
 -- ============================================================
 -- FUNCTION: claim_pending_videos
+-- p_skip_keys: key "mal_id:episode:provider:resolution" (resolution NULL → '')
+-- yang sedang diproses worker — dibiarkan tetap 'pending', tidak di-claim.
+-- p_only_keys: kalau diisi, hanya key ini yang boleh di-claim (dipakai
+-- /trigger supaya batch webhook meng-claim tepat baris yang di-trigger).
 -- ============================================================
-CREATE OR REPLACE FUNCTION claim_pending_videos(p_limit INTEGER DEFAULT 5)
+DROP FUNCTION IF EXISTS claim_pending_videos(INTEGER);
+DROP FUNCTION IF EXISTS claim_pending_videos(INTEGER, TEXT[]);
+
+CREATE OR REPLACE FUNCTION claim_pending_videos(
+  p_limit     INTEGER DEFAULT 5,
+  p_skip_keys TEXT[]  DEFAULT '{}',
+  p_only_keys TEXT[]  DEFAULT NULL
+)
 RETURNS SETOF video_queue
 LANGUAGE plpgsql
 AS $$
@@ -381,6 +417,13 @@ BEGIN
   WHERE id IN (
     SELECT id FROM video_queue
     WHERE status = 'pending'
+      AND NOT (
+        mal_id || ':' || episode || ':' || provider || ':' || COALESCE(resolution, '')
+      ) = ANY (p_skip_keys)
+      AND (
+        p_only_keys IS NULL
+        OR (mal_id || ':' || episode || ':' || provider || ':' || COALESCE(resolution, '')) = ANY (p_only_keys)
+      )
     ORDER BY created_at ASC
     LIMIT p_limit
     FOR UPDATE SKIP LOCKED
@@ -415,6 +458,33 @@ BEGIN
 END;
 $$;
 
+-- ============================================================
+-- FUNCTION: update_video_queue_status_batch
+-- Update status banyak entry sekaligus dalam satu RPC.
+-- Dipakai worker untuk transisi non-terminal (downloading/uploading).
+-- Baris yang sudah 'ready'/'failed' tidak disentuh, jadi batch yang telat
+-- tidak bisa menimpa status terminal.
+-- p_updates: [{"id": "<uuid>", "status": "uploading"}, ...]
+-- ============================================================
+CREATE OR REPLACE FUNCTION update_video_queue_status_batch(p_updates JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  updated_count INTEGER;
+BEGIN
+  UPDATE video_queue q
+  SET status     = u.status,
+      updated_at = NOW()
+  FROM jsonb_to_recordset(p_updates) AS u(id UUID, status VARCHAR(20))
+  WHERE q.id = u.id
+    AND q.status NOT IN ('ready', 'failed');
+
+  GET DIAGNOSTICS updated_count = ROW_COUNT;
+  RETURN updated_count;
+END;
+$$;
+
 -- ============================================================
 -- FUNCTION: upsert_video_store
 -- Simpan hasil upload HF ke video_store + mark queue sebagai ready.
@@ -469,3 +539,22 @@ BEGIN
   RETURN result;
 END;
 $$;
+
+-- ============================================================
+-- FUNCTION: get_video_queue_counts
+-- Jumlah entry video_queue per status, dihitung di database
+-- (dipakai endpoint /status worker — tidak perlu tarik semua row).
+-- Return: {"pending": 3, "ready": 120, ...}
+-- ============================================================
+CREATE OR REPLACE FUNCTION get_video_queue_counts()
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COALESCE(jsonb_object_agg(status, cnt), '{}'::jsonb)
+  FROM (
+    SELECT status, COUNT(*) AS cnt
+    FROM video_queue
+    GROUP BY status
+  ) s;
+$$;